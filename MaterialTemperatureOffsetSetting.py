@@ -11,7 +11,20 @@ from UM.Settings.DefinitionContainer import DefinitionContainer
 from UM.Settings.ContainerRegistry import ContainerRegistry
 from UM.Logger import Logger
 
+_PROCESSED_MARKER = ";TEMPOFFSETPROCESSED\n"
+
+# the optional tool parameter is emitted by Cura for multi-extruder machines and kept in the adjusted line
+# M104 S0 switches the hotend off and must not be offset, so the integer part has to be nonzero
+_HOTEND_TEMP_RE = re.compile(r"^M104 (T\d+ )?S(0*[1-9]\d*)(?:\.(\d+))?[^\n]*", re.MULTILINE)
+
+def _formatTenths(tenths):
+    # temperatures are handled as integer tenths of a degree to stay clear of float rounding noise
+    sign = "-" if tenths < 0 else ""
+    return "%s%d.%d" % ((sign,) + divmod(abs(tenths), 10))
+
 class MaterialTemperatureOffsetSetting(Extension):
+    _SETTING_KEY = "material_temp_offset"
+
     def __init__(self):
         super().__init__()
 
@@ -20,7 +33,7 @@ class MaterialTemperatureOffsetSetting(Extension):
         self._i18n_catalog = None
 
         self._settings_dict = OrderedDict()
-        self._settings_dict["material_temp_offset"] = {
+        self._settings_dict[self._SETTING_KEY] = {
             "label": "Temperature Offset",
             "description": "Change printing temperature relative to the material's temperature.",
             "type": "float",
@@ -57,9 +70,11 @@ class MaterialTemperatureOffsetSetting(Extension):
             return
         
         material_category = container.findDefinitions(key="material")
-        temp_offset_setting = container.findDefinitions(key=list(self._settings_dict.keys())[0])
+        if not material_category:
+            # skip definitions without a material category
+            return
 
-        if material_category and not temp_offset_setting:
+        if not container.findDefinitions(key=self._SETTING_KEY):
             # this machine doesn't have a temp offset setting yet
             material_category = material_category[0]
             for setting_key, setting_dict in self._settings_dict.items():
@@ -88,61 +103,74 @@ class MaterialTemperatureOffsetSetting(Extension):
             return
 
         # get setting from Cura
-        temp_offset_value = global_container_stack.getProperty("material_temp_offset", "value")
-        if temp_offset_value == 0:
+        temp_offset_value = global_container_stack.getProperty(self._SETTING_KEY, "value")
+        offset_tenths = int(round(temp_offset_value * 10))
+        if offset_tenths == 0:
             return
 
-        gcode_dict = getattr(scene, "gcode_dict", {})
-        if not gcode_dict: # this also checks for an empty dict
+        gcode_dict = getattr(scene, "gcode_dict", None)
+        if not gcode_dict: # this also checks for a missing or empty dict
             Logger.log("w", "Scene has no gcode to process")
             return
 
-        dict_changed = False
-        hotend_temp_regex = re.compile(r"(M104\s.*S)(\d*\.?\d*)(.*)")
+        if all(_PROCESSED_MARKER in gcode_list[0] for gcode_list in gcode_dict.values() if gcode_list):
+            # exporting the same scene again, there is nothing left to adjust
+            Logger.log("d", "All plates have already been processed")
+            return
 
-        for plate_id in gcode_dict:
-            gcode_list = gcode_dict[plate_id]
+        # the offset and helpers are bound as defaults so the callbacks read them as locals
+        def adjust_temperature_tenths(result, offset_tenths = offset_tenths, format_tenths = _formatTenths):
+            fraction = result.group(3)
+            tenths = int(result.group(2)) * 10
+            if fraction:
+                # round further decimals to the nearest tenth instead of dropping them
+                tenths += int(fraction[0]) + (int(fraction[1:2] or 0) >= 5)
+            return "M104 %sS%s ;adjusted by temp offset" % (result.group(1) or "", format_tenths(tenths + offset_tenths))
+
+        def adjust_temperature_degrees(result, offset_degrees = offset_tenths // 10, fallback = adjust_temperature_tenths):
+            if result.group(3):
+                # the temperature in the gcode has a fractional part
+                return fallback(result)
+            return "M104 %sS%d ;adjusted by temp offset" % (result.group(1) or "", int(result.group(2)) + offset_degrees)
+
+        # whole degree offsets are by far the most common, they don't need any tenths handling
+        if offset_tenths % 10 == 0:
+            adjust_temperature = adjust_temperature_degrees
+        else:
+            adjust_temperature = adjust_temperature_tenths
+
+        for plate_id, gcode_list in gcode_dict.items():
             if len(gcode_list) < 2:
                 Logger.log("w", "Plate %s does not contain any layers", plate_id)
                 continue
 
-            if ";TEMPOFFSETPROCESSED\n" not in gcode_list[0]:
-                # look for the first line that contains a G0 or G1 move on the Z axis
-                # gcode_list[2] is the first layer, after the preamble and the start gcode
-
-                if ";LAYER:0\n" in gcode_list[1]:
+            if _PROCESSED_MARKER not in gcode_list[0]:
+                # gcode_list[1] is the start gcode, followed by the layers
+                start_gcode = gcode_list[1]
+                layer_start = start_gcode.find(";LAYER:0\n")
+                if layer_start != -1:
                     # layer 0 somehow got appended to the start gcode chunk
-                    chunks = gcode_list[1].split(";LAYER:0\n")
-                    gcode_list[1] = chunks[0]
-                    gcode_list.insert(2, ";LAYER:0\n" + chunks[1])
-
-                # find the first vertical G0/G1, adjust it and reset the internal coordinate to apply offset to all subsequent moves
-                for (list_nr, list) in enumerate(gcode_list):
-                    lines = list.split("\n")
-                    for (line_nr, line) in enumerate(lines):
-
-                        result = hotend_temp_regex.fullmatch(line)
-                        if result:
-                            parsed = float(result.group(2))
-                            if parsed == 0:
-                                Logger.log("d", "Temparature in line %s is 0, skipping", line)
-                                continue
-                            try:
-                                adjusted_temp = round(parsed + temp_offset_value, 5)
-                            except ValueError:
-                                Logger.log("e", "Unable to process Temparature in line %s", line)
-                                continue
-                            lines[line_nr] = "M104 S" + str(adjusted_temp)+ " ;adjusted by temp offset"
-                            break
-
-                    gcode_list[list_nr] = "\n".join(lines)
-
-                gcode_list[0] += ";TEMPOFFSETPROCESSED\n"
-                gcode_dict[plate_id] = gcode_list
-                dict_changed = True
+                    start_chunks = [start_gcode[:layer_start], start_gcode[layer_start:]]
+                else:
+                    start_chunks = [start_gcode]
+
+                # the slice assignment keeps the list object Cura holds, and only shifts the layers when layer 0 was split off
+                gcode_list[1:2] = start_chunks
+
+                # apply the offset to the first hotend temperature command of every chunk, this includes the
+                # switch from the initial layer temperature to the print temperature in the layer chunks
+                for (list_nr, chunk) in enumerate(gcode_list):
+                    if "M104" not in chunk:
+                        # no hotend temperature in this chunk, leave it untouched
+                        continue
+
+                    # only the first temperature line of a chunk is replaced, in a single scan of the chunk
+                    adjusted_chunk, count = _HOTEND_TEMP_RE.subn(adjust_temperature, chunk, count = 1)
+                    if count:
+                        gcode_list[list_nr] = adjusted_chunk
+
+                # the preamble is only a few hundred bytes and no other handler moves it, unlike the chunks after it
+                gcode_list[0] += _PROCESSED_MARKER
             else:
                 Logger.log("d", "Plate %s has already been processed", plate_id)
                 continue
-
-        if dict_changed:
-            setattr(scene, "gcode_dict", gcode_dict)